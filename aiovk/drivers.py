@@ -44,10 +44,20 @@ class BaseDriver:
 
 
 class HttpDriver(BaseDriver):
+    # keep idle connections longer than the long poll wait period so that
+    # consecutive long poll requests reuse the same socket
+    keepalive_timeout = 60
+    ttl_dns_cache = 300
+
     def __init__(self, timeout=10, loop=None, session=None):
         super().__init__(timeout, loop)
         if not session:
-            self.session = aiohttp.ClientSession(loop=loop)
+            connector = aiohttp.TCPConnector(
+                keepalive_timeout=self.keepalive_timeout,
+                ttl_dns_cache=self.ttl_dns_cache,
+                loop=loop
+            )
+            self.session = aiohttp.ClientSession(connector=connector, loop=loop)
         else:
             self.session = session
 
@@ -1,4 +1,5 @@
 import json
+import logging
 from abc import ABC, abstractmethod
 from typing import Union, Optional
 import random
@@ -9,6 +10,22 @@ from .exceptions import VkLongPollError
 
 from messaging.messaging import ROUTING_KEYS
 
+try:
+    from orjson import dumps as _orjson_dumps, loads as _json_loads
+
+    def _json_dumps(obj, default=None) -> str:
+        return _orjson_dumps(obj, default=default).decode()
+except ImportError:
+    from json import loads as _json_loads
+
+    def _json_dumps(obj, default=None) -> str:
+        return json.dumps(obj, ensure_ascii=False, default=default)
+
+# random_id is only used for message de-duplication, a private generator is enough
+_random_id = random.Random().getrandbits
+
+logger = logging.getLogger(__name__)
+
 
 class BaseLongPoll(ABC):
     """Interface for all types of Longpoll API"""
@@ -58,50 +75,77 @@ class BaseLongPoll(ABC):
 
         :param need_pts: need return the pts field
         """
-        if not self.base_url:
-            await self._get_long_poll_server(need_pts)
-
-        params = {
-            'ts': self.ts,
-            'key': self.key,
-        }
-        params.update(self.base_params)
-        # invalid mimetype from server
-        status, response, _ = await self.api._session.driver.get_text(
-            self.base_url, params,
-            timeout=2 * self.base_params['wait']
-        )
-
-        if status == 403:
-            raise VkLongPollError(403, 'smth weth wrong', self.base_url + '/', params)
-
-        response = json.loads(response)
-        failed = response.get('failed')
-
-        if not failed:
-            self.ts = response['ts']
-            return response
-
-        if failed == 1:
-            self.ts = response['ts']
-        elif failed == 4:
-            raise VkLongPollError(
-                4,
-                'An invalid version number was passed in the version parameter',
-                self.base_url + '/',
-                params
+        while True:
+            if not self.base_url:
+                await self._get_long_poll_server(need_pts)
+
+            params = self.base_params.copy()
+            params['ts'] = self.ts
+            params['key'] = self.key
+            # invalid mimetype from server
+            status, response, _ = await self.api._session.driver.get_text(
+                self.base_url, params,
+                timeout=2 * params['wait']
             )
-        else:
-            self.base_url = None
 
-        return await self.wait()
+            if status == 403:
+                raise VkLongPollError(403, 'smth weth wrong', self.base_url + '/', params)
+
+            response = _json_loads(response)
+            failed = response.get('failed')
+
+            if not failed:
+                self.ts = response['ts']
+                return response
+
+            if failed == 1:
+                self.ts = response['ts']
+            elif failed == 4:
+                raise VkLongPollError(
+                    4,
+                    'An invalid version number was passed in the version parameter',
+                    self.base_url + '/',
+                    params
+                )
+            else:
+                self.base_url = None
     
     async def iter(self):
+        wait = self.wait
         while True:
-            response = await self.wait()
-            for event in response['updates']:
+            # keep only the updates list so the rest of the response can be freed
+            updates = (await wait())['updates']
+            for event in updates:
                 yield event
 
+    async def iter_events(self, cls):
+        """Iterate over events wrapped into event objects
+
+        All updates of one long poll response are parsed before yielding.
+        `ts` has already moved past the response at this point, so an update
+        that fails to parse does not drop the rest of the batch: valid events
+        are yielded first and then the first parse error is raised.
+        Every failed update is also logged, so errors after the first one are not lost.
+        Iteration can be started again to continue from the next response.
+
+        :param cls: event class, it is created from a single update
+        """
+        wait = self.wait
+        while True:
+            events = []
+            error = None
+            for update in (await wait())['updates']:
+                try:
+                    events.append(cls(update))
+                except Exception as e:
+                    logger.exception('Failed to parse long poll update %r', update)
+                    if error is None:
+                        error = e
+            for event in events:
+                yield event
+            if error is not None:
+                raise error
+
     async def get_pts(self, need_ts=False):
         if not self.base_url or not self.pts:
             await self._get_long_poll_server(need_pts=True)
@@ -124,6 +168,13 @@ class UserLongPoll(BaseLongPoll):
         # fucking differences between long poll methods in vk api!
         self.base_url = f'http{"s" if self.use_https else ""}://{response["server"]}'
 
+    def iter_events(self, cls=None):
+        """Iterate over events wrapped into event objects
+
+        :param cls: event class, :class:`MessageEvent` by default
+        """
+        return super().iter_events(MessageEvent if cls is None else cls)
+
 
 class LongPoll(UserLongPoll):
     """Implements https://vk.com/dev/using_longpoll
@@ -154,8 +205,10 @@ class BotsLongPoll(BaseLongPoll):
 """
 
 from collections import defaultdict
-from datetime import datetime
+from datetime import datetime, timezone
 from enum import IntEnum
+from functools import lru_cache
+from html import unescape
 
 import requests
 
@@ -403,42 +456,42 @@ class VkChatEventType(IntEnum):
     KEYBOARD_RECEIVED = 11
 
 
-MESSAGE_EXTRA_FIELDS = [
+MESSAGE_EXTRA_FIELDS = (
     'peer_id', 'timestamp', 'text', 'extra_values', 'attachments', 'random_id'
-]
+)
 MSGID = 'message_id'
 
 EVENT_ATTRS_MAPPING = {
-    VkEventType.MESSAGE_FLAGS_REPLACE: [MSGID, 'flags'] + MESSAGE_EXTRA_FIELDS,
-    VkEventType.MESSAGE_FLAGS_SET: [MSGID, 'mask'] + MESSAGE_EXTRA_FIELDS,
-    VkEventType.MESSAGE_FLAGS_RESET: [MSGID, 'mask'] + MESSAGE_EXTRA_FIELDS,
-    VkEventType.MESSAGE_NEW: [MSGID, 'flags'] + MESSAGE_EXTRA_FIELDS,
-    VkEventType.MESSAGE_EDIT: [MSGID, 'mask'] + MESSAGE_EXTRA_FIELDS,
+    VkEventType.MESSAGE_FLAGS_REPLACE: (MSGID, 'flags') + MESSAGE_EXTRA_FIELDS,
+    VkEventType.MESSAGE_FLAGS_SET: (MSGID, 'mask') + MESSAGE_EXTRA_FIELDS,
+    VkEventType.MESSAGE_FLAGS_RESET: (MSGID, 'mask') + MESSAGE_EXTRA_FIELDS,
+    VkEventType.MESSAGE_NEW: (MSGID, 'flags') + MESSAGE_EXTRA_FIELDS,
+    VkEventType.MESSAGE_EDIT: (MSGID, 'mask') + MESSAGE_EXTRA_FIELDS,
 
-    VkEventType.READ_ALL_INCOMING_MESSAGES: ['peer_id', 'local_id'],
-    VkEventType.READ_ALL_OUTGOING_MESSAGES: ['peer_id', 'local_id'],
+    VkEventType.READ_ALL_INCOMING_MESSAGES: ('peer_id', 'local_id'),
+    VkEventType.READ_ALL_OUTGOING_MESSAGES: ('peer_id', 'local_id'),
 
-    VkEventType.USER_ONLINE: ['user_id', 'extra', 'timestamp'],
-    VkEventType.USER_OFFLINE: ['user_id', 'flags', 'timestamp'],
+    VkEventType.USER_ONLINE: ('user_id', 'extra', 'timestamp'),
+    VkEventType.USER_OFFLINE: ('user_id', 'flags', 'timestamp'),
 
-    VkEventType.PEER_FLAGS_RESET: ['peer_id', 'mask'],
-    VkEventType.PEER_FLAGS_REPLACE: ['peer_id', 'flags'],
-    VkEventType.PEER_FLAGS_SET: ['peer_id', 'mask'],
+    VkEventType.PEER_FLAGS_RESET: ('peer_id', 'mask'),
+    VkEventType.PEER_FLAGS_REPLACE: ('peer_id', 'flags'),
+    VkEventType.PEER_FLAGS_SET: ('peer_id', 'mask'),
 
-    VkEventType.PEER_DELETE_ALL: ['peer_id', 'local_id'],
-    VkEventType.PEER_RESTORE_ALL: ['peer_id', 'local_id'],
+    VkEventType.PEER_DELETE_ALL: ('peer_id', 'local_id'),
+    VkEventType.PEER_RESTORE_ALL: ('peer_id', 'local_id'),
 
-    VkEventType.CHAT_EDIT: ['chat_id', 'self'],
-    VkEventType.CHAT_UPDATE: ['type_id', 'peer_id', 'info'],
+    VkEventType.CHAT_EDIT: ('chat_id', 'self'),
+    VkEventType.CHAT_UPDATE: ('type_id', 'peer_id', 'info'),
 
-    VkEventType.USER_TYPING: ['user_id', 'flags'],
-    VkEventType.USER_TYPING_IN_CHAT: ['user_id', 'chat_id'],
-    VkEventType.USER_RECORDING_VOICE: ['peer_id', 'user_id', 'flags', 'timestamp'],
+    VkEventType.USER_TYPING: ('user_id', 'flags'),
+    VkEventType.USER_TYPING_IN_CHAT: ('user_id', 'chat_id'),
+    VkEventType.USER_RECORDING_VOICE: ('peer_id', 'user_id', 'flags', 'timestamp'),
 
-    VkEventType.USER_CALL: ['user_id', 'call_id'],
+    VkEventType.USER_CALL: ('user_id', 'call_id'),
 
-    VkEventType.MESSAGES_COUNTER_UPDATE: ['count'],
-    VkEventType.NOTIFICATION_SETTINGS_UPDATE: ['values']
+    VkEventType.MESSAGES_COUNTER_UPDATE: ('count',),
+    VkEventType.NOTIFICATION_SETTINGS_UPDATE: ('values',)
 }
 
 def get_all_event_attrs():
@@ -447,18 +500,74 @@ def get_all_event_attrs():
     for l in EVENT_ATTRS_MAPPING.values():
         keys.update(l)
 
-    return tuple(keys)
+    return tuple(sorted(keys))
 
 
 ALL_EVENT_ATTRS = get_all_event_attrs()
 
-PARSE_PEER_ID_EVENTS = [
+# Атрибуты MessageEvent, которые не приходят в событии напрямую
+EVENT_STATE_ATTRS = (
+    'routing_key', 'raw', 'type', '_datetime', 'group_id',
+    'from_user', 'from_chat', 'from_group', 'from_me', 'to_me',
+    'keyboard', 'message_data', 'fwd_messages', 'state', 'payload',
+    'message', 'message_flags', 'peer_flags', 'platform', 'offline_type', 'update_type'
+)
+
+PARSE_PEER_ID_EVENTS = frozenset(
     k for k, v in EVENT_ATTRS_MAPPING.items() if 'peer_id' in v
-]
-PARSE_MESSAGE_FLAGS_EVENTS = [
+)
+PARSE_MESSAGE_FLAGS_EVENTS = frozenset({
     VkEventType.MESSAGE_FLAGS_REPLACE,
     VkEventType.MESSAGE_NEW
-]
+})
+
+_EVENT_TYPE_TABLE = {x.value: x for x in VkEventType}
+_CHAT_EVENT_TYPE_TABLE = {x.value: x for x in VkChatEventType}
+_MESSAGE_FLAG_TABLE = {x.value: x for x in VkMessageFlag}
+_PEER_FLAG_TABLE = {x.value: x for x in VkPeerFlag}
+_PLATFORM_TABLE = {x.value: x for x in VkPlatform}
+_OFFLINE_TYPE_TABLE = {x.value: x for x in VkOfflineType}
+
+
+def _decompose_flags(flags, table):
+    # перебираются только установленные известные биты, начиная с младшего
+    flags &= sum(table)
+    result = []
+    while flags:
+        bit = flags & -flags
+        result.append(table[bit])
+        flags ^= bit
+    return frozenset(result)
+
+
+@lru_cache(maxsize=4096)
+def _decompose_message_flags(flags):
+    return _decompose_flags(flags, _MESSAGE_FLAG_TABLE)
+
+
+@lru_cache(maxsize=64)
+def _decompose_peer_flags(flags):
+    return _decompose_flags(flags, _PEER_FLAG_TABLE)
+
+
+def _attachments_to_str(attachments):
+    """Приводит вложения к строке через запятую, как ожидает messages.send"""
+    if not attachments:
+        return ''
+    if isinstance(attachments, str):
+        return attachments
+    if isinstance(attachments, dict):
+        # вложения из longpoll: {'attach1_type': 'photo', 'attach1': '1_2', ...}
+        result = []
+        i = 1
+        key = 'attach1'
+        while key in attachments:
+            # тип и id склеиваются одним вызовом join, ключ форматируется один раз
+            result.append(''.join((attachments.get(key + '_type', ''), str(attachments[key]))))
+            i += 1
+            key = f'attach{i}'
+        return ','.join(result)
+    return ','.join(map(str, attachments))
 
 
 class MessageEvent(object):
@@ -472,8 +581,15 @@ class MessageEvent(object):
         - `message` - оригинальный текст сообщения.
 
     События с полем `timestamp` также дополнительно имеют поле `datetime`.
+
+    Поля `message_flags` и `peer_flags` - общие для одинаковых значений `flags`
+    неизменяемые множества. Для проверки одного флага без построения множества
+    можно использовать маску напрямую: ``event.flags & VkMessageFlag.OUTBOX``.
     """
 
+    # __dict__ оставлен для произвольных ключей из extra_values
+    __slots__ = tuple(sorted(set(ALL_EVENT_ATTRS).union(EVENT_STATE_ATTRS))) + ('__dict__',)
+
     def __init__(self, raw):
         self.routing_key = ROUTING_KEYS['vk_send_message']
         self.raw = raw
@@ -490,6 +606,7 @@ class MessageEvent(object):
 
         self.message_id = None
         self.timestamp = None
+        self._datetime = None
         self.peer_id = None
         self.flags = None
         self.extra = None
@@ -500,10 +617,11 @@ class MessageEvent(object):
         
         self.state = ''
         
-        try:
-            self.type = VkEventType(self.raw[0])
-            self._list_to_attr(self.raw[1:], EVENT_ATTRS_MAPPING[self.type])
-        except ValueError:
+        event_type = _EVENT_TYPE_TABLE.get(self.raw[0])
+        if event_type is not None:
+            self.type = event_type
+            self._list_to_attr(self.raw[1:], EVENT_ATTRS_MAPPING[event_type])
+        else:
             self.type = self.raw[0]
 
         if self.extra_values:
@@ -515,67 +633,53 @@ class MessageEvent(object):
         if self.type in PARSE_MESSAGE_FLAGS_EVENTS:
             self._parse_message_flags()
 
-        if self.type is VkEventType.CHAT_UPDATE:
-            self._parse_chat_info()
-            try:
-                self.update_type = VkChatEventType(self.type_id)
-            except ValueError:
-                self.update_type = self.type_id
-
-        elif self.type is VkEventType.NOTIFICATION_SETTINGS_UPDATE:
-            self._dict_to_attr(self.values)
-            self._parse_peer_id()
-
-        elif self.type is VkEventType.PEER_FLAGS_REPLACE:
-            self._parse_peer_flags()
+        handler = self._EVENT_HANDLERS.get(self.type)
+        if handler is not None:
+            getattr(self, handler)()
 
-        elif self.type in [VkEventType.MESSAGE_NEW, VkEventType.MESSAGE_EDIT]:
-            self._parse_message()
+    @property
+    def datetime(self):
+        # Вычисляется при первом обращении, большинству обработчиков не нужен
+        if self._datetime is None and self.timestamp:
+            # UTC без часового пояса, как раньше, но без устаревшего utcfromtimestamp
+            self._datetime = datetime.fromtimestamp(self.timestamp, timezone.utc).replace(tzinfo=None)
+        return self._datetime
 
-        elif self.type in [VkEventType.USER_ONLINE, VkEventType.USER_OFFLINE]:
-            self.user_id = abs(self.user_id)
-            self._parse_online_status()
-
-        elif self.type is VkEventType.USER_RECORDING_VOICE:
-            if isinstance(self.user_id, list):
-                self.user_id = self.user_id[0]
-
-        if self.timestamp:
-            self.datetime = datetime.utcfromtimestamp(self.timestamp)
+    @datetime.setter
+    def datetime(self, value):
+        self._datetime = value
 
     def _list_to_attr(self, raw, attrs):
-        for i in range(min(len(raw), len(attrs))):
-            self.__setattr__(attrs[i], raw[i])
+        for attr, value in zip(attrs, raw):
+            setattr(self, attr, value)
 
     def _dict_to_attr(self, values):
         for k, v in values.items():
             self.__setattr__(k, v)
 
     def _parse_peer_id(self):
-        if self.peer_id < 0:  # Сообщение от/для группы
-            self.from_group = True
-            self.group_id = abs(self.peer_id)
-
-        elif self.peer_id > CHAT_START_ID:  # Сообщение из беседы
-            self.from_chat = True
-            self.chat_id = self.peer_id - CHAT_START_ID
-
-            if self.extra_values and 'from' in self.extra_values:
-                self.user_id = int(self.extra_values['from'])
-
-        else:  # Сообщение от/для пользователя
-            self.from_user = True
-            self.user_id = self.peer_id
+        peer_id = self.peer_id
+        is_group = peer_id < 0  # Сообщение от/для группы
+        is_chat = peer_id > CHAT_START_ID  # Сообщение из беседы
+
+        self.from_group = is_group
+        self.from_chat = is_chat
+        self.from_user = not (is_group or is_chat)  # Сообщение от/для пользователя
+        self.group_id = -peer_id if is_group else None
+        self.chat_id = peer_id - CHAT_START_ID if is_chat else None
+
+        if is_chat:
+            extra_values = self.extra_values
+            if extra_values and 'from' in extra_values:
+                self.user_id = int(extra_values['from'])
+        elif not is_group:
+            self.user_id = peer_id
 
     def _parse_message_flags(self):
-        self.message_flags = set(
-            x for x in VkMessageFlag if self.flags & x
-        )
+        self.message_flags = _decompose_message_flags(self.flags)
 
     def _parse_peer_flags(self):
-        self.peer_flags = set(
-            x for x in VkPeerFlag if self.flags & x
-        )
+        self.peer_flags = _decompose_peer_flags(self.flags)
 
     def _parse_message(self):
         if self.type is VkEventType.MESSAGE_NEW:
@@ -588,22 +692,18 @@ class MessageEvent(object):
         # при этом переводы строк закодированы как <br> и не экранированы
 
         self.text = self.text.replace('<br>', '\n')
-        self.message = self.text \
-            .replace('&lt;', '<') \
-            .replace('&gt;', '>') \
-            .replace('&quot;', '"') \
-            .replace('&amp;', '&')
+        self.message = unescape(self.text)
 
     def _parse_online_status(self):
-        try:
-            if self.type is VkEventType.USER_ONLINE:
-                self.platform = VkPlatform(self.extra & 0xFF)
+        if self.type is VkEventType.USER_ONLINE:
+            platform = _PLATFORM_TABLE.get(self.extra & 0xFF)
+            if platform is not None:
+                self.platform = platform
 
-            elif self.type is VkEventType.USER_OFFLINE:
-                self.offline_type = VkOfflineType(self.flags)
-
-        except ValueError:
-            pass
+        elif self.type is VkEventType.USER_OFFLINE:
+            offline_type = _OFFLINE_TYPE_TABLE.get(self.flags)
+            if offline_type is not None:
+                self.offline_type = offline_type
 
     def _parse_chat_info(self):
         if self.type_id == VkChatEventType.ADMIN_ADDED.value:
@@ -617,6 +717,35 @@ class MessageEvent(object):
                               VkChatEventType.USER_KICKED.value,
                               VkChatEventType.ADMIN_REMOVED.value]:
             self.info = {'user_id': self.info}
+
+    def _parse_chat_update(self):
+        self._parse_chat_info()
+        self.update_type = _CHAT_EVENT_TYPE_TABLE.get(self.type_id, self.type_id)
+
+    def _parse_notification_settings(self):
+        self._dict_to_attr(self.values)
+        self._parse_peer_id()
+
+    def _parse_online(self):
+        self.user_id = abs(self.user_id)
+        self._parse_online_status()
+
+    def _parse_recording_voice(self):
+        if isinstance(self.user_id, list):
+            self.user_id = self.user_id[0]
+
+    # Имена обработчиков, вызываемых в __init__ в зависимости от типа события.
+    # Хранятся имена, а не функции, чтобы учитывались переопределения в наследниках
+    _EVENT_HANDLERS = {
+        VkEventType.CHAT_UPDATE: '_parse_chat_update',
+        VkEventType.NOTIFICATION_SETTINGS_UPDATE: '_parse_notification_settings',
+        VkEventType.PEER_FLAGS_REPLACE: '_parse_peer_flags',
+        VkEventType.MESSAGE_NEW: '_parse_message',
+        VkEventType.MESSAGE_EDIT: '_parse_message',
+        VkEventType.USER_ONLINE: '_parse_online',
+        VkEventType.USER_OFFLINE: '_parse_online',
+        VkEventType.USER_RECORDING_VOICE: '_parse_recording_voice',
+    }
     
     def to_serializable(self):
         return {
@@ -689,7 +818,8 @@ class MessageEvent(object):
         :param payload: Additional payload data.
         :return: A new MessageEvent object configured as a reply.
         """
-        reply_event = MessageEvent(raw=self.raw.copy())
+        # raw is only read while parsing and is replaced below, so no copy is needed
+        reply_event = MessageEvent(raw=self.raw)
 
         # Set peer_id as per the original message source
         if self.from_user:
@@ -735,16 +865,19 @@ class MessageEvent(object):
         """
         if self.type == VkEventType.MESSAGE_NEW :
             # Construct the command for sending a message to a user
-            user_id = self.peer_id
-            message_text = self.text
-            random_id = random.randint(0, 2048)
-
-            # If the event includes attachments or other special content, add those here
-            attachments = self.attachments if self.attachments else ''
+            params = {
+                "user_id": str(self.peer_id),
+                "message": self.text,
+                # If the event includes attachments or other special content, add those here
+                "attachment": _attachments_to_str(self.attachments),
+                "random_id": _random_id(31),
+            }
+            # JSON encoding escapes quotes and control characters in the text
+            params = _json_dumps(params)
             if self.keyboard:
-                command = f"""API.messages.send({{"user_id": "{user_id}","message": "{message_text}","attachment": "{attachments}","keyboard": json_{self.state}_{self.peer_id}, "random_id": {random_id}}})"""
-            else:
-                command = f"""API.messages.send({{"user_id": "{user_id}","message": "{message_text}","attachment": "{attachments}", "random_id": {random_id}}})"""
+                # keyboard is a VKScript variable, so it is added unquoted
+                params = f'{params[:-1]}, "keyboard": json_{self.state}_{self.peer_id}}}'
+            command = f'API.messages.send({params})'
         return command
     
 class EventEncoder(json.JSONEncoder):
@@ -752,3 +885,18 @@ class EventEncoder(json.JSONEncoder):
         if isinstance(obj, MessageEvent):
             return obj.to_serializable()
         return json.JSONEncoder.default(self, obj)
+
+
+def _event_default(obj):
+    if isinstance(obj, MessageEvent):
+        return obj.to_serializable()
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+
+def dumps_event(obj) -> str:
+    """Serialize a MessageEvent, or any JSON structure containing them, to a JSON string
+
+    Uses orjson if it is installed, otherwise the standard json module.
+    `EventEncoder` is still available for `json.dumps(..., cls=EventEncoder)` calls.
+    """
+    return _json_dumps(obj, default=_event_default)
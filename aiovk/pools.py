@@ -44,9 +44,17 @@ class AsyncVkExecuteRequestPool:
     one request using `execute` method
     """
 
-    def __init__(self, call_number_per_request=25, token_session_class=TokenSession):
+    def __init__(self, call_number_per_request=25, token_session_class=TokenSession, driver=None):
+        """
+        :param call_number_per_request: max number of calls in one execute request
+        :param token_session_class: session class created for each token
+        :param driver: driver shared by sessions of all tokens, it is passed to
+                       `token_session_class` as `driver` and is not closed by the pool.
+                       If not passed, every session creates and closes its own driver
+        """
         self.token_session_class = token_session_class
         self.call_number_per_request = call_number_per_request
+        self.driver = driver
         self.pool: Dict[str, List[VkCall]] = defaultdict(list)
         self.sessions = []
 
@@ -59,18 +67,30 @@ class AsyncVkExecuteRequestPool:
     async def execute(self):
         try:
             await self._execute()
-            await asyncio.gather(*[session.close() for session in self.sessions])
         finally:
+            await self._close()
             self.pool.clear()
             self.sessions.clear()
 
+    async def _close(self):
+        # an external driver is closed by its owner
+        if self.driver is None:
+            await asyncio.gather(*[session.close() for session in self.sessions])
+
     async def _execute(self):
         """
         Groups hits and executes them using the execute method, after execution the pool is cleared
         """
+        if not self.pool:
+            return
+
         executed_pools = []
         for token, calls in self.pool.items():
-            session = self.token_session_class(token)
+            if self.driver is None:
+                session = self.token_session_class(token)
+            else:
+                # all tokens share one driver, so requests reuse the same connection pool
+                session = self.token_session_class(token, driver=self.driver)
             self.sessions.append(session)
             api = API(session)
 
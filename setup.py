@@ -31,6 +31,9 @@ setup(
 
     packages=find_packages(),
     install_requires=requirements,
+    extras_require={
+        'speedups': ['uvloop>=0.18; sys_platform != "win32"', 'orjson>=3'],
+    },
 
     license='MIT License',
     classifiers=[
@@ -5,7 +5,7 @@ import pytest
 from aiovk import LongPoll, API
 from aiovk.drivers import BaseDriver
 from aiovk.exceptions import VkLongPollError
-from aiovk.longpoll import BotsLongPoll
+from aiovk.longpoll import BotsLongPoll, MessageEvent, VkEventType
 from aiovk.sessions import BaseSession
 
 pytestmark = pytest.mark.asyncio
@@ -18,6 +18,7 @@ class Driver(BaseDriver):
     expected_version = None
     expected_ts = None
     expected_mode = None
+    expected_timeout = None
 
     async def get_text(self, url, params, timeout=None):
         message = json.dumps(self.messages[self.counter])
@@ -31,6 +32,9 @@ class Driver(BaseDriver):
         if self.expected_ts is not None:
             assert params['ts'] == self.expected_ts
 
+        if self.expected_timeout is not None:
+            assert timeout == self.expected_timeout
+
         return 200, message, url
 
 
@@ -175,3 +179,59 @@ async def test_longpoll_iter(longpoll, messages, exception, ts):
         with pytest.raises(exception):
             async for _ in lp.iter():
                 pass
+
+
+async def test_longpoll_wait_timeout_follows_base_params():
+    session = Session()
+    session.driver.messages = [{'ts': 2, 'updates': []}, {'ts': 3, 'updates': []}]
+    lp = LongPoll(session, mode=0, wait=25)
+
+    session.driver.expected_timeout = 50
+    await lp.wait()
+    lp.base_params['wait'] = 10
+    session.driver.expected_timeout = 20
+    await lp.wait()
+
+
+async def test_longpoll_iter_events():
+    update = [VkEventType.MESSAGE_NEW, 1, 0, 1, 1600000000, 'text', {}]
+    session = Session()
+    session.driver.messages = [{'ts': 2, 'updates': [update, update]}]
+    lp = LongPoll(session, mode=0)
+
+    events = []
+    async for event in lp.iter_events():
+        events.append(event)
+        if len(events) == 2:
+            break
+    assert all(isinstance(event, MessageEvent) for event in events)
+    assert all(event.message == 'text' for event in events)
+
+
+async def test_longpoll_iter_events_keeps_batch_on_parse_error(caplog):
+    update = [VkEventType.MESSAGE_NEW, 1, 0, 1, 1600000000, 'text', {}]
+    session = Session()
+    session.driver.messages = [{'ts': 2, 'updates': [update, [], update, {}]}]
+    lp = LongPoll(session, mode=0)
+
+    events = []
+    with pytest.raises(IndexError):
+        async for event in lp.iter_events():
+            events.append(event)
+    assert len(events) == 2
+    assert lp.ts == 2
+    failures = [r for r in caplog.records if r.name == 'aiovk.longpoll']
+    assert [type(r.exc_info[1]) for r in failures] == [IndexError, KeyError]
+
+
+async def test_bots_longpoll_iter_events():
+    session = Session()
+    session.driver.messages = [{'ts': 2, 'updates': [Driver.original_event]}]
+    lp = BotsLongPoll(session, group_id=1)
+
+    with pytest.raises(TypeError):
+        lp.iter_events()
+
+    async for event in lp.iter_events(dict):
+        assert event == Driver.original_event
+        break
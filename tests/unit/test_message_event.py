@@ -0,0 +1,190 @@
+import json
+from datetime import datetime
+
+import pytest
+
+from aiovk.longpoll import CHAT_START_ID, EventEncoder, MessageEvent, VkChatEventType, VkEventType, VkMessageFlag, \
+    VkOfflineType, VkPeerFlag, VkPlatform, dumps_event
+
+
+@pytest.mark.parametrize(
+    'flags, expected',
+    [
+        (0, set()),
+        (VkMessageFlag.OUTBOX, {VkMessageFlag.OUTBOX}),
+        (VkMessageFlag.UNREAD | VkMessageFlag.CHAT | VkMessageFlag.DELETED_ALL,
+         {VkMessageFlag.UNREAD, VkMessageFlag.CHAT, VkMessageFlag.DELETED_ALL}),
+        (2**30 | VkMessageFlag.MEDIA, {VkMessageFlag.MEDIA}),
+    ]
+)
+def test_message_flags(flags, expected):
+    event = MessageEvent([VkEventType.MESSAGE_NEW, 1, flags, 1, 1600000000, 'text', {}])
+    assert event.message_flags == expected
+
+
+@pytest.mark.parametrize(
+    'flags, expected',
+    [
+        (0, set()),
+        (VkPeerFlag.IMPORTANT, {VkPeerFlag.IMPORTANT}),
+        (VkPeerFlag.IMPORTANT | VkPeerFlag.UNANSWERED, {VkPeerFlag.IMPORTANT, VkPeerFlag.UNANSWERED}),
+    ]
+)
+def test_peer_flags(flags, expected):
+    event = MessageEvent([VkEventType.PEER_FLAGS_REPLACE, -1, flags])
+    assert event.peer_flags == expected
+
+
+@pytest.mark.parametrize(
+    'text, expected_text, expected_message',
+    [
+        ('hello', 'hello', 'hello'),
+        ('line1<br>line2', 'line1\nline2', 'line1\nline2'),
+        ('&lt;b&gt; &quot;q&quot;', '&lt;b&gt; &quot;q&quot;', '<b> "q"'),
+        ('&amp;lt;', '&amp;lt;', '&lt;'),
+    ]
+)
+def test_message_text_unescape(text, expected_text, expected_message):
+    event = MessageEvent([VkEventType.MESSAGE_NEW, 1, 0, 1, 1600000000, text, {}])
+    assert event.text == expected_text
+    assert event.message == expected_message
+
+
+def test_chat_message_extra_values():
+    event = MessageEvent([
+        VkEventType.MESSAGE_NEW, 10, 0, CHAT_START_ID + 7, 1600000000, 'hi', {'from': '42', 'title': 'chat'}
+    ])
+    assert event.from_chat
+    assert event.chat_id == 7
+    assert event.user_id == 42
+    assert event.title == 'chat'
+    assert event.message_id == 10
+
+
+def test_user_online():
+    event = MessageEvent([VkEventType.USER_ONLINE, -5, 4, 1600000000])
+    assert event.user_id == 5
+    assert event.platform == VkPlatform.ANDROID
+
+
+def test_user_offline():
+    event = MessageEvent([VkEventType.USER_OFFLINE, -5, 1, 1600000000])
+    assert event.offline_type is VkOfflineType.AWAY
+
+
+def test_unknown_online_status():
+    event = MessageEvent([VkEventType.USER_ONLINE, -5, 100, 1600000000])
+    assert not hasattr(event, 'platform')
+    event = MessageEvent([VkEventType.USER_OFFLINE, -5, 100, 1600000000])
+    assert not hasattr(event, 'offline_type')
+
+
+def test_user_recording_voice():
+    event = MessageEvent([VkEventType.USER_RECORDING_VOICE, CHAT_START_ID + 1, [5], 1, 1600000000])
+    assert event.user_id == 5
+
+
+def test_chat_update():
+    event = MessageEvent([VkEventType.CHAT_UPDATE, VkChatEventType.USER_JOINED, CHAT_START_ID + 1, 7])
+    assert event.update_type is VkChatEventType.USER_JOINED
+    assert event.info == {'user_id': 7}
+
+
+def test_datetime():
+    event = MessageEvent([VkEventType.MESSAGE_NEW, 1, 0, 1, 1600000000, 'text', {}])
+    assert event.datetime == datetime(2020, 9, 13, 12, 26, 40)
+
+    event = MessageEvent([VkEventType.MESSAGES_COUNTER_UPDATE, 3])
+    assert event.datetime is None
+
+
+def test_unknown_event_type():
+    event = MessageEvent([1000, 1, 2])
+    assert event.type == 1000
+
+
+def test_unknown_chat_update_type():
+    event = MessageEvent([VkEventType.CHAT_UPDATE, 100, CHAT_START_ID + 1, 7])
+    assert event.update_type == 100
+
+
+def test_create_reply():
+    raw = [VkEventType.MESSAGE_NEW, 10, 0, 5, 1600000000, 'hi', {}]
+    event = MessageEvent(raw)
+    reply = event.create_reply('hello', state='start')
+    assert event.raw == [VkEventType.MESSAGE_NEW, 10, 0, 5, 1600000000, 'hi', {}]
+    assert reply.peer_id == 5
+    assert reply.text == 'hello'
+    assert reply.from_me and not reply.to_me
+    assert reply.state == 'start'
+    assert reply.raw[3] == 5
+    assert reply.raw[5] == 'hello'
+
+
+@pytest.mark.parametrize('keyboard', ['', '{"buttons": []}'])
+def test_to_command(keyboard):
+    event = MessageEvent([VkEventType.MESSAGE_NEW, 10, 0, 5, 1600000000, 'hi', {}])
+    reply = event.create_reply('say "hello"\nworld', keyboard=keyboard, state='start')
+    command = reply.to_command()
+
+    assert command.startswith('API.messages.send({') and command.endswith('})')
+    params = command[len('API.messages.send('):-1]
+    if keyboard:
+        assert params.endswith(', "keyboard": json_start_5}')
+        params = params[:-len(', "keyboard": json_start_5}')] + '}'
+    params = json.loads(params)
+    assert params['user_id'] == '5'
+    assert params['message'] == 'say "hello"\nworld'
+    assert params['attachment'] == ''
+    assert 0 <= params['random_id'] < 2**31
+
+
+@pytest.mark.parametrize(
+    'peer_id, from_user, from_chat, from_group, user_id, chat_id, group_id',
+    [
+        (5, True, False, False, 5, None, None),
+        (-3, False, False, True, None, None, 3),
+        (CHAT_START_ID + 2, False, True, False, None, 2, None),
+    ]
+)
+def test_peer_id(peer_id, from_user, from_chat, from_group, user_id, chat_id, group_id):
+    event = MessageEvent([VkEventType.MESSAGE_NEW, 1, 0, peer_id, 1600000000, 'text', {}])
+    assert (event.from_user, event.from_chat, event.from_group) == (from_user, from_chat, from_group)
+    assert getattr(event, 'user_id', None) == user_id
+    assert event.chat_id == chat_id
+    assert event.group_id == group_id
+
+
+def test_dumps_event():
+    event = MessageEvent([VkEventType.MESSAGE_NEW, 10, 0, 5, 1600000000, 'привет', {}])
+    expected = json.loads(json.dumps(event, cls=EventEncoder))
+    assert json.loads(dumps_event(event)) == expected
+    assert json.loads(dumps_event([event])) == [expected]
+
+    with pytest.raises(TypeError):
+        dumps_event(object())
+
+
+@pytest.mark.parametrize(
+    'attachments, expected',
+    [
+        ('photo1_2', 'photo1_2'),
+        (['photo1_2', 'doc3_4'], 'photo1_2,doc3_4'),
+        ({'attach1_type': 'photo', 'attach1': '1_2', 'attach2_type': 'doc', 'attach2': '3_4'}, 'photo1_2,doc3_4'),
+    ]
+)
+def test_to_command_attachments(attachments, expected):
+    event = MessageEvent([VkEventType.MESSAGE_NEW, 10, 0, 5, 1600000000, 'hi', {}])
+    reply = event.create_reply('hello', attachments=attachments)
+    params = json.loads(reply.to_command()[len('API.messages.send('):-1])
+    assert params['attachment'] == expected
+
+
+def test_subclass_overrides_handler():
+    class UpperMessageEvent(MessageEvent):
+        def _parse_message(self):
+            super()._parse_message()
+            self.message = self.message.upper()
+
+    event = UpperMessageEvent([VkEventType.MESSAGE_NEW, 1, 0, 1, 1600000000, 'text', {}])
+    assert event.message == 'TEXT'
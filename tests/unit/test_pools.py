@@ -194,3 +194,100 @@ class ExecutePoolTestCase(IsolatedAsyncioTestCase):
         self.assertIsNotNone(result.error)
         self.assertEqual(27, result.error['error_code'])
         self.assertEqual('likes.isLiked', result.error['method'])
+
+
+class FakeDriver:
+    def __init__(self):
+        self.closed = 0
+        self.sessions = []
+
+    async def close(self):
+        self.closed += 1
+
+
+class FakeSession:
+    def __init__(self, access_token, driver=None):
+        self.access_token = access_token
+        self.driver = FakeDriver() if driver is None else driver
+        self.driver.sessions.append(self)
+
+    async def send_api_request(self, method_name, params=None, timeout=None, raw_response=False):
+        return {'response': [1] * params['code'].count('API.')}
+
+    async def close(self):
+        await self.driver.close()
+
+
+class FailingSession(FakeSession):
+    async def send_api_request(self, *args, **kwargs):
+        raise RuntimeError
+
+
+class ExecutePoolDriverTestCase(IsolatedAsyncioTestCase):
+    async def test_external_driver(self):
+        driver = FakeDriver()
+        pool = AsyncVkExecuteRequestPool(token_session_class=FakeSession, driver=driver)
+        result = pool.add_call('users.get', 'token1', {'user_ids': 1})
+        result2 = pool.add_call('users.get', 'token2', {'user_ids': 2})
+        await pool.execute()
+
+        self.assertEqual(2, len(driver.sessions))
+        self.assertEqual(0, driver.closed)
+        self.assertEqual(1, result.result)
+        self.assertEqual(1, result2.result)
+
+    async def test_external_driver_not_closed_on_error(self):
+        driver = FakeDriver()
+        pool = AsyncVkExecuteRequestPool(token_session_class=FailingSession, driver=driver)
+        pool.add_call('users.get', 'token1', {'user_ids': 1})
+        with self.assertRaises(RuntimeError):
+            await pool.execute()
+
+        self.assertEqual(0, driver.closed)
+
+    async def test_without_driver(self):
+        sessions = []
+
+        class TokenOnlySession(FakeSession):
+            def __init__(self, access_token):
+                super().__init__(access_token)
+                sessions.append(self)
+
+        async with AsyncVkExecuteRequestPool(token_session_class=TokenOnlySession) as pool:
+            result = pool.add_call('users.get', 'token1', {'user_ids': 1})
+            result2 = pool.add_call('users.get', 'token2', {'user_ids': 2})
+
+        self.assertEqual(2, len(sessions))
+        self.assertIsNot(sessions[0].driver, sessions[1].driver)
+        self.assertTrue(all(session.driver.closed == 1 for session in sessions))
+        self.assertEqual(1, result.result)
+        self.assertEqual(1, result2.result)
+
+    async def test_sessions_closed_on_error(self):
+        sessions = []
+
+        class TrackedSession(FailingSession):
+            def __init__(self, access_token):
+                super().__init__(access_token)
+                sessions.append(self)
+
+        pool = AsyncVkExecuteRequestPool(token_session_class=TrackedSession)
+        pool.add_call('users.get', 'token1', {'user_ids': 1})
+        with self.assertRaises(RuntimeError):
+            await pool.execute()
+
+        self.assertEqual(1, len(sessions))
+        self.assertEqual(1, sessions[0].driver.closed)
+
+    async def test_empty_pool(self):
+        sessions = []
+
+        class TrackedSession(FakeSession):
+            def __init__(self, access_token):
+                super().__init__(access_token)
+                sessions.append(self)
+
+        async with AsyncVkExecuteRequestPool(token_session_class=TrackedSession):
+            pass
+
+        self.assertEqual([], sessions)